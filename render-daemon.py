@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import sqlite3
+import datetime
+import argparse
+import threading
+import importlib.util
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+QUEUE_FILE = os.getenv("RENDER_QUEUE", "./queue/render-queue.db")
+
+SCRIPTS = {
+    "yaml": "yaml-to-pptx-video.py",
+    "pptx": "pptx-note-to-video.py",
+}
+
+# Arguments accepted per job kind, matching the main() of each script
+JOB_ARGS = {
+    "yaml": {"yml_file", "reuse", "reuse_threshold", "min_tokens", "max_tokens", "audio_in_memory"},
+    "pptx": {"input_pptx", "output_pptx", "slide"},
+}
+REQUIRED_ARGS = {
+    "yaml": {"yml_file"},
+    "pptx": {"input_pptx", "output_pptx"},
+}
+FILE_ARGS = {"yml_file", "input_pptx", "output_pptx"}
+
+def coerce_number(key, value, cast, minimum=0, maximum=None):
+    # JSON has no int/float distinction and clients send "0.9" as often as 0.9
+    if isinstance(value, bool):
+        raise ValueError(f"{key} must be a number")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be a number, got {value!r}")
+    if cast is int:
+        if not number.is_integer():
+            raise ValueError(f"{key} must be a whole number, got {value!r}")
+        number = int(number)
+    # Written as not >= so NaN is rejected too
+    if not number >= minimum or (maximum is not None and not number <= maximum):
+        bounds = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+        raise ValueError(f"{key} must be {bounds}, got {value!r}")
+    return number
+
+def validate_args(kind, args):
+    if kind not in SCRIPTS:
+        raise ValueError(f"Unknown job kind '{kind}', expected one of {', '.join(SCRIPTS)}")
+    if not isinstance(args, dict):
+        raise ValueError("Job args must be an object")
+    unknown = set(args) - JOB_ARGS[kind]
+    if unknown:
+        raise ValueError(f"Unknown {kind} job argument(s): {', '.join(sorted(unknown))}")
+    missing = REQUIRED_ARGS[kind] - set(args)
+    if missing:
+        raise ValueError(f"Missing {kind} job argument(s): {', '.join(sorted(missing))}")
+    args = dict(args)
+    for key in FILE_ARGS & set(args):
+        if not isinstance(args[key], str) or not args[key]:
+            raise ValueError(f"{key} must be a file path")
+        args[key] = os.path.abspath(args[key])
+    # Workers cannot answer the interactive reuse prompt
+    if args.get("reuse", "off") not in ("off", "auto"):
+        raise ValueError("reuse must be 'off' or 'auto' for queued jobs")
+    if "reuse_threshold" in args:
+        args["reuse_threshold"] = coerce_number("reuse_threshold", args["reuse_threshold"], float, 0, 1)
+    for key in ("min_tokens", "max_tokens"):
+        if key in args:
+            args[key] = coerce_number(key, args[key], int, 0)
+    if args.get("min_tokens") and args.get("max_tokens") and args["min_tokens"] > args["max_tokens"]:
+        raise ValueError("min_tokens cannot be larger than max_tokens")
+    if args.get("slide") is not None:
+        args["slide"] = coerce_number("slide", args["slide"], int, 1)
+    if "audio_in_memory" in args and not isinstance(args["audio_in_memory"], bool):
+        raise ValueError("audio_in_memory must be true or false")
+
+    return args
+
+def connect():
+    queue_dir = os.path.dirname(QUEUE_FILE)
+    if queue_dir:
+        os.makedirs(queue_dir, exist_ok=True)
+    connection = sqlite3.connect(QUEUE_FILE, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            args TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            output TEXT,
+            error TEXT,
+            created TEXT NOT NULL,
+            started TEXT,
+            finished TEXT
+        )""")
+    return connection
+
+def submit(kind, args, priority=0):
+    args = validate_args(kind, args)
+    with connect() as connection:
+        cursor = connection.execute("INSERT INTO jobs (kind, args, priority, created) VALUES (?, ?, ?, ?)",
+                                    (kind, json.dumps(args), priority, datetime.datetime.now().isoformat()))
+        return cursor.lastrowid
+
+def list_jobs(job_id=None):
+    with connect() as connection:
+        if job_id is not None:
+            rows = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchall()
+        else:
+            rows = connection.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+    return [dict(row, args=json.loads(row["args"])) for row in rows]
+
+def claim_job(connection):
+    # Highest priority first, then oldest. The status check in the UPDATE keeps
+    # two workers from claiming the same job.
+    with connection:
+        row = connection.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY priority DESC, id LIMIT 1").fetchone()
+        if row is None:
+            return None
+        claimed = connection.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ? AND status = 'queued'",
+                                     (datetime.datetime.now().isoformat(), row["id"])).rowcount
+    if not claimed:
+        return None
+    return list_jobs(row["id"])[0]
+
+def finish_job(connection, job_id, status, output=None, error=None):
+    with connection:
+        connection.execute("UPDATE jobs SET status = ?, output = ?, error = ?, finished = ? WHERE id = ?",
+                           (status, output, error, datetime.datetime.now().isoformat(), job_id))
+
+def load_script(path):
+    name = os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def load_scripts(interval):
+    """
+    Import the render scripts once so every job shares the same warm
+    OpenAI client, speech endpoint pool, template cache and avatar
+    submission rate limiter.
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    modules = {kind: load_script(os.path.join(script_dir, script)) for kind, script in SCRIPTS.items()}
+
+    shared = modules["yaml"]
+    for module in modules.values():
+        module.client = shared.client
+
+    # Both scripts import the same speech module, so they already share its
+    # endpoint pool and submission rate limiter
+    shared.speech.submit_limiter = shared.speech.RateLimiter(interval)
+
+    return modules
+
+def finish_job_with_retry(connection, job_id, status, output=None, error=None):
+    # A render can take an hour, don't lose its result to a locked database.
+    # If it still can't be written the job stays 'running' and is requeued on restart.
+    for attempt in range(5):
+        try:
+            finish_job(connection, job_id, status, output, error)
+            return
+        except sqlite3.Error as e:
+            print(f"Job {job_id}: failed to record status '{status}': {e}")
+            time.sleep(2 ** attempt)
+
+def worker(modules, stop):
+    connection = connect()
+    while not stop.is_set():
+        try:
+            job = claim_job(connection)
+        except sqlite3.Error as e:
+            print(f"Failed to claim a job: {e}")
+            stop.wait(2)
+            continue
+        if job is None:
+            stop.wait(2)
+            continue
+
+        print(f"Job {job['id']}: rendering {job['kind']} {job['args']}")
+        try:
+            output = modules[job["kind"]].main(**job["args"])
+        except Exception:
+            finish_job_with_retry(connection, job["id"], "failed", error=traceback.format_exc())
+            print(f"Job {job['id']}: failed")
+            traceback.print_exc()
+        else:
+            finish_job_with_retry(connection, job["id"], "done", output=output)
+            print(f"Job {job['id']}: done, saved {output}")
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, body):
+        data = json.dumps(body, indent=2).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            self.send_json(200, list_jobs())
+        elif len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            jobs = list_jobs(int(parts[1]))
+            if jobs:
+                self.send_json(200, jobs[0])
+            else:
+                self.send_json(404, {"error": f"Job {parts[1]} not found"})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path.strip("/") != "jobs":
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            job_id = submit(request["kind"], request.get("args", {}), request.get("priority", 0))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(201, list_jobs(job_id)[0])
+
+def serve(workers, port, interval):
+    # Jobs that were running when the daemon stopped start over; the avatar
+    # job journal lets them reattach to their server side jobs.
+    with connect() as connection:
+        requeued = connection.execute("UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running'").rowcount
+    if requeued:
+        print(f"Requeued {requeued} interrupted job(s)")
+
+    modules = load_scripts(interval)
+    stop = threading.Event()
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), RequestHandler)
+    print(f"Render daemon listening on http://127.0.0.1:{port} with {workers} worker(s)")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(workers):
+            executor.submit(worker, modules, stop)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("Stopping, waiting for running jobs to finish...")
+        finally:
+            stop.set()
+            server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="render-daemon", description="Render units and decks from a local job queue with shared clients.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run the daemon.")
+    serve_parser.add_argument("--workers", type=int, default=2, help="Number of jobs rendered in parallel.")
+    serve_parser.add_argument("--port", type=int, default=8765, help="Port of the local HTTP interface.")
+    serve_parser.add_argument("--interval", type=float, default=35, help="Minimum seconds between avatar job submissions, across all workers.")
+
+    yaml_parser = subparsers.add_parser("submit-yaml", help="Queue a module unit YAML file.")
+    yaml_parser.add_argument("--yml_file", type=str, help="Path to the YAML file.", required=True)
+    yaml_parser.add_argument("--reuse", type=str, choices=["off", "auto"], default="off", help="Reuse outputs of previously rendered near-duplicate sections.")
+    yaml_parser.add_argument("--reuse_threshold", type=float, default=0.9, help="Minimum similarity (0-1) for a section to be considered a near-duplicate.")
+    yaml_parser.add_argument("--min_tokens", type=int, default=0, help="Merge sections smaller than this many tokens.")
+    yaml_parser.add_argument("--max_tokens", type=int, default=0, help="Split sections larger than this many tokens.")
+    yaml_parser.add_argument("--audio_in_memory", action="store_true", help="Embed the synthesized audio directly instead of writing it to ./audio first.")
+    yaml_parser.add_argument("--priority", type=int, default=0, help="Higher priority jobs are rendered first.")
+
+    pptx_parser = subparsers.add_parser("submit-pptx", help="Queue a PowerPoint file with speaker notes.")
+    pptx_parser.add_argument("--input_pptx", type=str, help="Path to the powerpoint file", required=True)
+    pptx_parser.add_argument("--slide", type=int, help="Slide number (omit if you want to generate avatar video on each slide)", required=False)
+    pptx_parser.add_argument("--output_pptx", type=str, help="Path to the powerpoint file", required=True)
+    pptx_parser.add_argument("--priority", type=int, default=0, help="Higher priority jobs are rendered first.")
+
+    status_parser = subparsers.add_parser("status", help="Show queued, running and finished jobs.")
+    status_parser.add_argument("--job", type=int, help="Only show this job.", required=False)
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.workers, args.port, args.interval)
+    elif args.command in ("submit-yaml", "submit-pptx"):
+        if args.command == "submit-yaml":
+            kind, job_args = "yaml", {"yml_file": args.yml_file, "reuse": args.reuse, "reuse_threshold": args.reuse_threshold,
+                                      "min_tokens": args.min_tokens, "max_tokens": args.max_tokens, "audio_in_memory": args.audio_in_memory}
+        else:
+            kind, job_args = "pptx", {"input_pptx": args.input_pptx, "output_pptx": args.output_pptx, "slide": args.slide}
+        try:
+            job_id = submit(kind, job_args, args.priority)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Queued job {job_id}")
+    else:
+        for job in list_jobs(args.job):
+            print(f"{job['id']:>5}  {job['status']:<8} priority {job['priority']:<3} {job['kind']}  {job['output'] or job['args']}")
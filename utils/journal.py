@@ -0,0 +1,65 @@
+import os
+import json
+import hashlib
+import datetime
+import threading
+
+# Local journal of batch avatar jobs, one JSON object per line. The last line
+# for a job ID is its current state, so the file is only ever appended to and
+# a run that gets killed mid-poll leaves enough behind to reattach later.
+# Jobs are keyed by their source (the section markdown, or the transcript
+# itself when it is not generated) rather than by the generated transcript,
+# which differs from one run to the next.
+JOURNAL_FILE = os.getenv("AVATAR_JOURNAL", "./journal/avatar-jobs.jsonl")
+
+_lock = threading.Lock()
+
+def source_hash(source):
+    return hashlib.sha256(source.strip().encode("utf-8")).hexdigest()
+
+def record(job_id, source, mp4_filename, status, endpoint_id=None, transcript=None):
+    entry = {
+        "job_id": job_id,
+        "source_hash": source_hash(source),
+        "mp4_filename": os.path.normpath(mp4_filename),
+        "endpoint": endpoint_id,
+        "status": status,
+        "transcript": transcript,
+        "timestamp": datetime.datetime.now().isoformat(),
+    }
+
+    with _lock:
+        journal_dir = os.path.dirname(JOURNAL_FILE)
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+        with open(JOURNAL_FILE, 'a') as file:
+            file.write(json.dumps(entry) + "\n")
+
+def load():
+    jobs = {}
+    if not os.path.exists(JOURNAL_FILE):
+        return jobs
+
+    with _lock, open(JOURNAL_FILE, 'r') as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from a killed process
+                continue
+            jobs[entry["job_id"]] = entry
+    return jobs
+
+def find_job(source, mp4_filename):
+    """
+    Return the most recent journal entry for the same source and target
+    file that has not failed, or None if the job has to be submitted.
+    """
+    digest = source_hash(source)
+    target = os.path.normpath(mp4_filename)
+
+    matches = [job for job in load().values()
+               if job.get("source_hash") == digest and job["mp4_filename"] == target and job["status"] != "Failed"]
+    if not matches:
+        return None
+    return max(matches, key=lambda job: job["timestamp"])
@@ -0,0 +1,152 @@
+import os
+import re
+import json
+import random
+import shutil
+import hashlib
+import datetime
+import threading
+
+# Index of previously rendered sections. Each entry keeps a MinHash signature
+# of the normalized markdown together with the generated bullets, transcript
+# and copies of the audio and video, so a near-duplicate section in another
+# unit can reuse them instead of paying for a new avatar render.
+INDEX_DIR = os.getenv("SECTION_INDEX_DIR", "./cache/sections")
+
+NUM_PERMUTATIONS = 128
+SHINGLE_SIZE = 3
+# Sections with fewer shingles (empty, header-only, image-only) are never matched
+MIN_SHINGLES = 5
+_PRIME = (1 << 61) - 1
+# Includes can include other files, stop following them after this many levels
+MAX_INCLUDE_DEPTH = 3
+
+_INCLUDE = re.compile(r"\[!include\[[^\]]*\]\(([^)]*)\)\]")
+
+_lock = threading.Lock()
+
+_random = random.Random(42)
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+def resolve_includes(markdown, base_dir, depth=0):
+    """
+    Replace include directives with the content of the included file, relative
+    to base_dir, so sections that include the same snippet match on its text.
+    Directives that cannot be resolved are left in place.
+    """
+    if base_dir is None or depth >= MAX_INCLUDE_DEPTH:
+        return markdown
+
+    def include(match):
+        path = os.path.normpath(os.path.join(base_dir, match.group(1).strip()))
+        try:
+            with open(path, 'r') as file:
+                content = file.read()
+        except OSError:
+            return match.group(0)
+        return resolve_includes(content, os.path.dirname(path), depth + 1)
+
+    return _INCLUDE.sub(include, markdown)
+
+def normalize(markdown):
+    text = markdown.lower()
+    text = _INCLUDE.sub(r" include \1 ", text)                      # unresolved include directives, keep the path
+    text = re.sub(r"!?\[([^\]]*)\]\([^)]*\)", r"\1", text)          # links and images, keep the label
+    text = re.sub(r"<[^>]+>", " ", text)                             # html tags
+    text = re.sub(r"[^a-z0-9]+", " ", text)                          # markdown syntax and punctuation
+    return text.split()
+
+def shingles(markdown, base_dir=None):
+    words = normalize(resolve_includes(markdown, base_dir))
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def signature(markdown, base_dir=None):
+    section_shingles = shingles(markdown, base_dir)
+    if len(section_shingles) < MIN_SHINGLES:
+        return None
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big") for shingle in section_shingles]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+def similarity(signature_a, signature_b):
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / NUM_PERMUTATIONS
+
+class SectionIndex:
+    def __init__(self, index_dir=INDEX_DIR):
+        self.index_dir = index_dir
+        self.index_file = os.path.join(index_dir, "index.json")
+        self.log_file = os.path.join(index_dir, "reuse-log.jsonl")
+        self.entries = []
+        self.reload()
+
+    def reload(self):
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as file:
+                self.entries = json.load(file)
+
+    def find(self, section_signature, mode):
+        """
+        Return the most similar indexed section rendered in the same mode
+        whose outputs still exist, together with its similarity.
+        """
+        best, best_similarity = None, 0.0
+        if section_signature is None:
+            return best, best_similarity
+        for entry in self.entries:
+            if entry["signature"] is None or entry["mode"] != mode or not all(os.path.exists(entry[key]) for key in ("audio_filename", "mp4_filename")):
+                continue
+            entry_similarity = similarity(section_signature, entry["signature"])
+            if entry_similarity > best_similarity:
+                best, best_similarity = entry, entry_similarity
+        return best, best_similarity
+
+    def add(self, uid, title, mode, section_signature, bullets, transcript, audio_filename, mp4_filename, audio_data=None):
+        os.makedirs(self.index_dir, exist_ok=True)
+        entry_id = hashlib.sha256(f"{uid}/{title}".encode("utf-8")).hexdigest()[:16]
+
+        # Keep our own copy, ./audio and ./video are overwritten when a unit is rendered again
+        cached_audio = os.path.join(self.index_dir, f"{entry_id}.wav")
+        cached_mp4 = os.path.join(self.index_dir, f"{entry_id}.mp4")
+        if audio_data is not None:
+            with open(cached_audio, 'wb') as file:
+                file.write(audio_data)
+        else:
+            shutil.copyfile(audio_filename, cached_audio)
+        shutil.copyfile(mp4_filename, cached_mp4)
+        srt_filename = mp4_filename.replace('.mp4', '.srt')
+        if os.path.exists(srt_filename):
+            shutil.copyfile(srt_filename, cached_mp4.replace('.mp4', '.srt'))
+
+        with _lock:
+            # Pick up sections indexed by other jobs in the same process since we loaded
+            self.reload()
+            self.entries = [entry for entry in self.entries if entry["id"] != entry_id]
+            self.entries.append({
+                "id": entry_id,
+                "uid": uid,
+                "title": title,
+                "mode": mode,
+                "signature": section_signature,
+                "bullets": bullets,
+                "transcript": transcript,
+                "audio_filename": cached_audio,
+                "mp4_filename": cached_mp4,
+            })
+
+            with open(self.index_file, 'w') as file:
+                json.dump(self.entries, file)
+
+    def log(self, uid, title, match, match_similarity, reused):
+        os.makedirs(self.index_dir, exist_ok=True)
+        entry = {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "uid": uid,
+            "title": title,
+            "match_uid": match["uid"],
+            "match_title": match["title"],
+            "similarity": round(match_similarity, 3),
+            "reused": reused,
+        }
+        with open(self.log_file, 'a') as file:
+            file.write(json.dumps(entry) + "\n")
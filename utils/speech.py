@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import uuid
+import threading
+import requests
+import azure.cognitiveservices.speech as speechsdk
+from dotenv import load_dotenv
+
+import journal
+import speechpool
+
+# Text to speech and batch avatar synthesis shared by yaml-to-pptx-video.py,
+# pptx-note-to-video.py and the notebook magics in ai.py.
+
+speechsdk._log_level = speechsdk.LogLevel.Error
+
+load_dotenv()
+
+def create_speech_config(region, key, output_format=None):
+    if output_format is None:
+        output_format = speechsdk.SpeechSynthesisOutputFormat.Riff24Khz16BitMonoPcm
+    speech_config = speechsdk.SpeechConfig(subscription=key, region=region)
+    speech_config.set_speech_synthesis_output_format(output_format)  
+    return speech_config
+
+speech_pool = speechpool.from_env(create_speech_config)
+
+class RateLimiter:
+    """
+    Spaces out calls across threads, so the process as a whole stays within
+    the avatar batch synthesis submission rate.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._next - now)
+            self._next = max(now, self._next) + self.interval
+        if delay:
+            time.sleep(delay)
+
+# Waited on right before each avatar job submission. render-daemon replaces it
+# with one configured from --interval; set to None to disable spacing.
+submit_limiter = RateLimiter(float(os.getenv("AVATAR_SUBMIT_INTERVAL", "35")))
+
+RETRYABLE_CANCELLATIONS = (
+    speechsdk.CancellationErrorCode.TooManyRequests,
+    speechsdk.CancellationErrorCode.ConnectionFailure,
+    speechsdk.CancellationErrorCode.ServiceTimeout,
+    speechsdk.CancellationErrorCode.ServiceError,
+    speechsdk.CancellationErrorCode.ServiceUnavailable,
+)
+
+def generate_audio(transcript: str, audio_filename: str = None, output_format=None, voice=None):
+    # Without a filename the audio is only kept in memory, in result.audio_data
+    if audio_filename is not None:
+        os.makedirs(os.path.dirname(audio_filename) or ".", exist_ok=True)
+
+    tried = []
+    for attempt in range(speechpool.MAX_ATTEMPTS):
+        endpoint = speech_pool.acquire_next(tried, workload="tts")
+        start = time.monotonic()
+
+        speech_config = endpoint.speech_config
+        if output_format is not None or voice is not None:
+            speech_config = create_speech_config(endpoint.region, endpoint.key, output_format)
+            if voice is not None:
+                speech_config.speech_synthesis_voice_name = voice
+
+        file_config = speechsdk.audio.AudioOutputConfig(filename=audio_filename) if audio_filename is not None else None
+        speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=file_config)  
+
+        result = speech_synthesizer.speak_text_async(transcript).get()
+        throttled = result.reason == speechsdk.ResultReason.Canceled and result.cancellation_details.error_code in RETRYABLE_CANCELLATIONS
+        # Synthesis time grows with the transcript, so compare endpoints per 1000 characters
+        latency = (time.monotonic() - start) / max(len(transcript), 1) * 1000
+        speech_pool.release(endpoint, ok=not throttled, latency=latency, workload="tts")
+        if not throttled:
+            if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+                details = result.cancellation_details.error_details if result.reason == speechsdk.ResultReason.Canceled else result.reason
+                raise RuntimeError(f'Speech synthesis failed on {endpoint.region}: {details}')
+            return result
+        print(f'- Speech synthesis failed on {endpoint.region}: {result.cancellation_details.error_details}')
+
+    raise RuntimeError(f'Speech synthesis failed after {speechpool.MAX_ATTEMPTS} attempts: {result.cancellation_details.error_details}')
+
+def batch_synthesis_url(job_id, endpoint):
+    return f'https://{endpoint.region}.api.cognitive.microsoft.com/avatar/batchsyntheses/{job_id}?api-version=2024-04-15-preview'
+
+# Server side states worth reattaching to, anything else (Failed, unknown job) is submitted again
+REATTACHABLE_STATUSES = ('NotStarted', 'Running', 'Succeeded')
+
+def generate_video(transcript, mp4_filename, video_crop=True, source=None):
+    """
+    Render transcript as an avatar video into mp4_filename. source is what the
+    transcript was generated from and keys the job journal; pass it when the
+    transcript itself is not reproducible (for example generated by an LLM).
+    """
+    source = source if source is not None else transcript
+
+    job = journal.find_job(source, mp4_filename)
+    if job is not None and job["status"] == "Downloaded" and os.path.exists(mp4_filename):
+        print(f'- Reusing {mp4_filename} from batch avatar job {job["job_id"]}')
+        return
+
+    # Reattach to a job that was submitted by an earlier (interrupted) run
+    endpoint = speech_pool.get(job.get("endpoint")) if job is not None else None
+    if endpoint is not None and get_synthesis(batch_synthesis_url(job["job_id"], endpoint), endpoint.key) in REATTACHABLE_STATUSES:
+        print(f'- Reattaching to batch avatar job {job["job_id"]} on {endpoint.region}')
+        poll_video(transcript, source, mp4_filename, job["job_id"], speech_pool.acquire(endpoint=endpoint))
+        return
+
+    job_id = str(uuid.uuid4())
+
+    payload = {
+        'synthesisConfig': {
+            "voice": 'en-US-AvaMultilingualNeural',
+        },
+        'customVoices': {
+            # "YOUR_CUSTOM_VOICE_NAME": "YOUR_CUSTOM_VOICE_ID"
+        },
+        "inputKind": "plainText",
+        "inputs": [
+            {
+                "content": transcript,
+            },
+        ],
+        "avatarConfig":
+            {
+                "customized": False, # set to True if you want to use customized avatar
+                "talkingAvatarCharacter": 'Lisa',  # talking avatar character
+                "talkingAvatarStyle": 'technical-sitting',  # talking avatar style, required for prebuilt avatar, optional for custom avatar
+                "videoFormat": "mp4",
+                "videoCodec": "h264",
+                "subtitleType": "external_file",
+                "backgroundColor": "#FFFFFFFF", # background color in RGBA format, default is white; can be set to 'transparent' for transparent background
+                "videoCrop": {  "topLeft": { "x": 560, "y": 0}, "bottomRight": { "x": 1360, "y": 1079}  }
+            }  
+    }
+    #"videoCrop": {  "topLeft": { "x": 460, "y": 0}, "bottomRight": { "x": 1460, "y": 1079}  }
+    if not video_crop:
+        del payload["avatarConfig"]["videoCrop"]
+
+    # Submit to the best endpoint, failing over to the next one on 429s, server and connection errors
+    tried = []
+    for attempt in range(speechpool.MAX_ATTEMPTS):
+        # Wait for our turn before picking an endpoint, so the choice reflects its health when we submit
+        if submit_limiter is not None:
+            submit_limiter.wait()
+
+        endpoint = speech_pool.acquire_next(tried, workload="avatar")
+
+        header = {
+            'Content-Type': 'application/json',
+            'Ocp-Apim-Subscription-Key': endpoint.key
+        }
+
+        try:
+            response = requests.put(batch_synthesis_url(job_id, endpoint), json.dumps(payload, default=str), headers=header)
+        except requests.RequestException as e:
+            print(f'- Failed to submit batch avatar job on {endpoint.region}: {e}')
+            speech_pool.release(endpoint, ok=False)
+            continue
+
+        if response.status_code < 400:
+            print(f'Job ID: {response.json()["id"]} ({endpoint.region})')
+            speech_pool.report(endpoint, latency=response.elapsed.total_seconds(), workload="avatar")
+            journal.record(job_id, source, mp4_filename, "Submitted", endpoint.id, transcript)
+            poll_video(transcript, source, mp4_filename, job_id, endpoint)
+            return
+
+        print(f'- Failed to submit batch avatar job on {endpoint.region}: [{response.status_code}], {response.text}')
+        speech_pool.release(endpoint, ok=not speechpool.is_throttled(response.status_code))
+        if not speechpool.is_throttled(response.status_code):
+            raise RuntimeError(f'Batch avatar job for {mp4_filename} was rejected: [{response.status_code}], {response.text}')
+
+    raise RuntimeError(f'Failed to submit batch avatar job for {mp4_filename} after {speechpool.MAX_ATTEMPTS} attempts')
+
+def poll_video(transcript, source, mp4_filename, job_id, endpoint):
+    url = batch_synthesis_url(job_id, endpoint)
+
+    try:
+        while True:
+            status = get_synthesis(url, endpoint.key)
+            if status == 'Succeeded':
+                journal.record(job_id, source, mp4_filename, "Succeeded", endpoint.id, transcript)
+                print('- batch avatar job succeeded')
+                download_url, subtitle_url = getdownloadurl(url, endpoint.key)
+                
+                response = requests.get(download_url)
+                with open(mp4_filename, 'wb') as file:
+                    print("Saving video as ", mp4_filename)
+                    file.write(response.content) 
+                
+                local_srt_url = mp4_filename.replace('.mp4', '.srt')
+
+                response = requests.get(subtitle_url)
+                with open(local_srt_url, 'wb') as file:
+                    file.write(response.content)   
+                
+                journal.record(job_id, source, mp4_filename, "Downloaded", endpoint.id, transcript)
+                break
+            elif status == 'Failed':
+                print('- batch avatar job failed')
+                journal.record(job_id, source, mp4_filename, "Failed", endpoint.id, transcript)
+                break
+            else:
+                print(f'- batch avatar job is [{status}]')
+                time.sleep(5)
+    finally:
+        speech_pool.release(endpoint)
+
+def get_synthesis(url, key):
+    header = {
+        'Ocp-Apim-Subscription-Key': key
+    }
+
+    response = requests.get(url, headers=header)
+    if response.status_code < 400:
+        if response.json()['status'] == 'Succeeded':
+            print(f'Download URL: {response.json()["outputs"]["result"]}')
+        return response.json()['status']
+    else:
+        print(f'- Failed to get batch job: {response.text}')       
+
+def getdownloadurl(url, key):
+    header = {
+        'Ocp-Apim-Subscription-Key': key
+    }
+
+    response = requests.get(url, headers=header)
+    if response.status_code < 400:
+        print('- Get batch avatar job successfully')
+        if response.json()['status'] == 'Succeeded':
+            return response.json()["outputs"]["result"], response.json()["outputs"]["subtitle"]
+    else:
+        print(f'- Failed to get batch avatar job: {response.text}')
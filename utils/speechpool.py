@@ -0,0 +1,137 @@
+import os
+import time
+import hashlib
+import threading
+
+# Seconds an endpoint is avoided after a 429 or server error. Doubles with
+# every consecutive error, up to MAX_COOLDOWN.
+COOLDOWN = 30
+MAX_COOLDOWN = 600
+
+# Attempts per request, across all endpoints, before giving up
+MAX_ATTEMPTS = 5
+
+class SpeechEndpoint:
+    def __init__(self, region, key, weight=1.0, speech_config=None):
+        self.region = region
+        self.key = key
+        # Stable across restarts and unique per key, so journaled jobs are polled with the key that submitted them
+        self.id = f"{region}-{hashlib.sha256((key or '').encode('utf-8')).hexdigest()[:8]}"
+        self.weight = weight
+        self.speech_config = speech_config
+        self.in_flight = 0
+        # Moving average per workload ("tts", "avatar"), they are not comparable
+        self.latency = {}
+        self.errors = 0
+        self.degraded_until = 0.0
+
+    def is_degraded(self):
+        return time.monotonic() < self.degraded_until
+
+    def __repr__(self):
+        return f"SpeechEndpoint({self.region}, weight={self.weight}, in_flight={self.in_flight})"
+
+class SpeechPool:
+    """
+    Routes Speech traffic across several region/key endpoints. Each request
+    goes to the healthy endpoint with the best weight relative to its
+    in-flight requests and observed latency; endpoints that recently returned
+    429s or server errors are skipped until their cooldown expires.
+    """
+    def __init__(self, endpoints):
+        if not endpoints:
+            raise ValueError("At least one speech endpoint is required")
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+
+    def get(self, endpoint_id):
+        return next((endpoint for endpoint in self.endpoints if endpoint.id == endpoint_id), None)
+
+    def _score(self, endpoint, workload):
+        latency = endpoint.latency.get(workload, 0.0)
+        return endpoint.weight / ((1 + endpoint.in_flight) * (1 + latency))
+
+    def acquire(self, exclude=(), endpoint=None, workload=None):
+        """
+        Pick an endpoint and count the request against it until release().
+        Pass endpoint to pin a request to a specific endpoint, for example to
+        poll a batch job that was submitted there.
+        """
+        with self._lock:
+            if endpoint is None:
+                candidates = [candidate for candidate in self.endpoints if candidate not in exclude] or self.endpoints
+                healthy = [candidate for candidate in candidates if not candidate.is_degraded()]
+                if healthy:
+                    endpoint = max(healthy, key=lambda candidate: self._score(candidate, workload))
+                else:
+                    # Everything is cooling down, use the one that recovers first
+                    endpoint = min(candidates, key=lambda candidate: candidate.degraded_until)
+            endpoint.in_flight += 1
+            return endpoint
+
+    def acquire_next(self, tried, workload=None):
+        """
+        Acquire an endpoint that has not been tried yet for this request.
+        Once every endpoint has been tried, wait until the first one comes
+        out of its cooldown and start over.
+        """
+        if len(tried) >= len(self.endpoints):
+            self.wait_for_recovery()
+            tried.clear()
+        endpoint = self.acquire(exclude=tried, workload=workload)
+        tried.append(endpoint)
+        return endpoint
+
+    def wait_for_recovery(self):
+        with self._lock:
+            delay = min(endpoint.degraded_until for endpoint in self.endpoints) - time.monotonic()
+        if delay > 0:
+            print(f"- All speech endpoints are degraded, waiting {delay:.0f} seconds")
+            time.sleep(delay)
+
+    def report(self, endpoint, ok=True, latency=None, workload=None):
+        with self._lock:
+            if latency is not None:
+                previous = endpoint.latency.get(workload)
+                endpoint.latency[workload] = latency if previous is None else 0.8 * previous + 0.2 * latency
+            if ok:
+                endpoint.errors = 0
+            else:
+                endpoint.errors += 1
+                cooldown = min(COOLDOWN * 2 ** (endpoint.errors - 1), MAX_COOLDOWN)
+                endpoint.degraded_until = time.monotonic() + cooldown
+                print(f"- Speech endpoint {endpoint.region} degraded, avoiding it for {cooldown} seconds")
+
+    def release(self, endpoint, ok=True, latency=None, workload=None):
+        self.report(endpoint, ok, latency, workload)
+        with self._lock:
+            endpoint.in_flight -= 1
+
+def is_throttled(status_code):
+    return status_code == 429 or status_code >= 500
+
+def from_env(config_factory=None):
+    """
+    Build the pool from SPEECH_ENDPOINTS, a comma separated list of
+    region:key[:weight] entries. Falls back to SPEECH_REGION / SPEECH_KEY.
+    config_factory(region, key) creates the speech SDK config per endpoint.
+    """
+    endpoints = []
+    for entry in os.getenv("SPEECH_ENDPOINTS", "").split(","):
+        if not entry.strip():
+            continue
+        parts = entry.strip().split(":")
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Invalid SPEECH_ENDPOINTS entry '{entry}', expected region:key[:weight]")
+        region, key = parts[0], parts[1]
+        weight = float(parts[2]) if len(parts) == 3 else 1.0
+        endpoints.append(SpeechEndpoint(region, key, weight))
+
+    if not endpoints:
+        endpoints.append(SpeechEndpoint(os.getenv("SPEECH_REGION"), os.getenv("SPEECH_KEY")))
+
+    if config_factory is not None:
+        for endpoint in endpoints:
+            endpoint.speech_config = config_factory(endpoint.region, endpoint.key)
+
+    return SpeechPool(endpoints)
@@ -1,7 +1,6 @@
 import yaml
 import re
 import os
-import azure.cognitiveservices.speech as speechsdk
 import logging
 import uuid
 import requests
@@ -9,20 +8,34 @@ import json
 import datetime
 import time
 import argparse
+import sys
+import io
+import threading
 from pptx import Presentation
+from pptx.media import Video
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 from pptx.enum.shapes import MSO_SHAPE_TYPE
 from pptx.util import Inches, Cm, Pt
 from lxml import etree
 
-speechsdk._log_level = speechsdk.LogLevel.Error
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils'))
+import journal
+import speech
+import sectionindex
 
 load_dotenv()
 
 client = AzureOpenAI(azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"), api_version="2024-02-15-preview", api_key=os.getenv("AZURE_OPENAI_API_KEY"))
-speech_config = speechsdk.SpeechConfig(subscription=os.getenv("SPEECH_KEY"), region=os.getenv("SPEECH_REGION"))
-speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat.Riff24Khz16BitMonoPcm)  
+
+template_cache = {}
+
+def load_template(template_path="template.pptx"):
+    # Keep the template in memory, a long running process renders many units from it
+    if template_path not in template_cache:
+        with open(template_path, 'rb') as file:
+            template_cache[template_path] = file.read()
+    return Presentation(io.BytesIO(template_cache[template_path]))
 
 def read_yml_file(file_path):
     yml_dir = os.path.dirname(file_path)
@@ -59,6 +72,94 @@ def read_sections_file(content_path, title):
 
         return sections
     
+WORDS_PER_MINUTE = 150
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for English text
+    return len(text) // 4
+
+def estimate_speaking_time(text):
+    return len(text.split()) / WORDS_PER_MINUTE * 60
+
+def split_paragraphs(content):
+    # Split at blank lines, but never inside a fenced code block
+    paragraphs, current, in_fence = [], [], False
+    for line in content.split("\n"):
+        if line.strip().startswith("```"):
+            in_fence = not in_fence
+        if not line.strip() and not in_fence:
+            if current:
+                paragraphs.append("\n".join(current))
+                current = []
+            continue
+        current.append(line)
+    if current:
+        paragraphs.append("\n".join(current))
+    return paragraphs
+
+def balance_sections(sections, min_tokens, max_tokens):
+    """
+    Merge adjacent sections below min_tokens and split sections above
+    max_tokens at paragraph breaks, so the number of slides (and avatar
+    jobs) follows the amount of content rather than the number of headers.
+    """
+    # Split oversized sections
+    split_sections = []
+    for section in sections:
+        if estimate_tokens(section["content"]) <= max_tokens:
+            split_sections.append(section)
+            continue
+
+        parts, current = [], []
+        for paragraph in split_paragraphs(section["content"]):
+            if current and estimate_tokens("\n\n".join(current + [paragraph])) > max_tokens:
+                parts.append("\n\n".join(current))
+                current = []
+            current.append(paragraph)
+        if current:
+            parts.append("\n\n".join(current))
+
+        for i, part in enumerate(parts):
+            part_title = section["title"] if i == 0 else f"{section['title']} (continued)"
+            split_sections.append({"title": part_title, "content": part})
+
+    # Merge undersized sections into the next one, or into the previous one
+    # when the next one has no room. Only sections that fit nowhere stay undersized.
+    def merge(first, second):
+        return {"title": first["title"], "content": first["content"] + "\n\n## " + second["title"] + "\n\n" + second["content"]}
+
+    def emit_pending(pending):
+        if balanced:
+            merged = merge(balanced[-1], pending)
+            if estimate_tokens(merged["content"]) <= max_tokens:
+                balanced[-1] = merged
+                return
+        balanced.append(pending)
+
+    balanced = []
+    pending = None
+    for section in split_sections:
+        if pending is not None:
+            merged = merge(pending, section)
+            if estimate_tokens(merged["content"]) <= max_tokens:
+                section = merged
+            else:
+                emit_pending(pending)
+            pending = None
+
+        if estimate_tokens(section["content"]) < min_tokens:
+            pending = section
+        else:
+            balanced.append(section)
+
+    if pending is not None:
+        emit_pending(pending)
+
+    for section in balanced:
+        print(f"- {section['title']}: ~{estimate_tokens(section['content'])} tokens, ~{estimate_speaking_time(section['content']):.0f} seconds")
+
+    return balanced
+    
 def generate_bullets(content):
     prompt = f"Generate a list of bullet points based on the following content:\n\n{content}"
     
@@ -123,114 +224,38 @@ def generate_speakertranscript(content, mode):
     output = completion.choices[0].message.content
     return output
 
-def generate_audio(transcript: str, audio_filename: str):
-    file_config = speechsdk.audio.AudioOutputConfig(filename=audio_filename)
-    speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=file_config)  
-
-    result = speech_synthesizer.speak_text_async(transcript).get()
-    return result
-
-def generate_video(transcript, mp4_filename):
-    job_id = str(uuid.uuid4())
-    download_url = None
-
-    url = f'https://{os.getenv("SPEECH_REGION")}.api.cognitive.microsoft.com/avatar/batchsyntheses/{job_id}?api-version=2024-04-15-preview'
+def find_reusable_section(section_index, uid, section, mode, reuse, reuse_threshold, base_dir=None):
+    # Includes are resolved relative to the unit markdown, so shared snippets compare on their content
+    section_signature = sectionindex.signature(section["content"], base_dir)
+    if reuse == "off":
+        return None, section_signature
 
-    header = {
-        'Content-Type': 'application/json',
-        'Ocp-Apim-Subscription-Key': os.getenv("SPEECH_KEY")
-    }
+    match, similarity = section_index.find(section_signature, mode)
+    if match is None or similarity < reuse_threshold:
+        return None, section_signature
 
-    payload = {
-        'synthesisConfig': {
-            "voice": 'en-US-AvaMultilingualNeural',
-        },
-        'customVoices': {
-            # "YOUR_CUSTOM_VOICE_NAME": "YOUR_CUSTOM_VOICE_ID"
-        },
-        "inputKind": "plainText",
-        "inputs": [
-            {
-                "content": transcript,
-            },
-        ],
-        "avatarConfig":
-            {
-                "customized": False, # set to True if you want to use customized avatar
-                "talkingAvatarCharacter": 'Lisa',  # talking avatar character
-                "talkingAvatarStyle": 'technical-sitting',  # talking avatar style, required for prebuilt avatar, optional for custom avatar
-                "videoFormat": "mp4",
-                "videoCodec": "h264",
-                "subtitleType": "external_file",
-                "backgroundColor": "#FFFFFFFF", # background color in RGBA format, default is white; can be set to 'transparent' for transparent background
-                "videoCrop": {  "topLeft": { "x": 560, "y": 0}, "bottomRight": { "x": 1360, "y": 1079}  }
-            }  
-    }
-    #"videoCrop": {  "topLeft": { "x": 460, "y": 0}, "bottomRight": { "x": 1460, "y": 1079}  }
-
-    response = requests.put(url, json.dumps(payload, default=str), headers=header)
-    if response.status_code < 400:
-        print(f'Job ID: {response.json()["id"]}')
-    else:
-        print(f'- Failed to submit batch avatar job: [{response.status_code}], {response.text}')
-
-    while True:
-        status = get_synthesis(url)
-        if status == 'Succeeded':
-            print('- batch avatar job succeeded')
-            download_url, subtitle_url = getdownloadurl(url)
-            
-            response = requests.get(download_url)
-            with open(mp4_filename, 'wb') as file:
-                file.write(response.content) 
-            
-            local_srt_url = mp4_filename.replace('.mp4', '.srt')
-
-            response = requests.get(subtitle_url)
-            with open(local_srt_url, 'wb') as file:
-                file.write(response.content)   
-                
-            break
-        elif status == 'Failed':
-            print('- batch avatar job failed')
-            break
-        else:
-            print(f'- batch avatar job is [{status}]')
-            time.sleep(5)
-
-def get_synthesis(url):
-    header = {
-        'Ocp-Apim-Subscription-Key': os.getenv("SPEECH_KEY")
-    }
-
-    response = requests.get(url, headers=header)
-    if response.status_code < 400:
-        if response.json()['status'] == 'Succeeded':
-            print(f'Download URL: {response.json()["outputs"]["result"]}')
-        return response.json()['status']
+    if reuse == "auto":
+        reused = True
     else:
-        print(f'- Failed to get batch job: {response.text}')       
+        answer = input(f"- Section is {similarity:.0%} similar to '{match['title']}' ({match['uid']}), reuse its outputs? [y/N] ")
+        reused = answer.strip().lower().startswith("y")
 
-def getdownloadurl(url):
-    header = {
-        'Ocp-Apim-Subscription-Key': os.getenv("SPEECH_KEY")
-    }
+    section_index.log(uid, section["title"], match, similarity, reused)
+    return (match if reused else None), section_signature
 
-    response = requests.get(url, headers=header)
-    if response.status_code < 400:
-        print('- Get batch avatar job successfully')
-        if response.json()['status'] == 'Succeeded':
-            return response.json()["outputs"]["result"], response.json()["outputs"]["subtitle"]
-    else:
-        print(f'- Failed to get batch avatar job: {response.text}')
-
-def main(yml_file):
+def main(yml_file, reuse="off", reuse_threshold=0.9, min_tokens=0, max_tokens=0, audio_in_memory=False):
     title, uid, content_path = read_yml_file(yml_file)
     sections = read_sections_file(content_path, title)
-    presentation = Presentation("template.pptx")
+    if min_tokens or max_tokens:
+        print(f"Balancing {len(sections)} sections")
+        sections = balance_sections(sections, min_tokens, max_tokens or float("inf"))
+    presentation = load_template()
+    section_index = sectionindex.SectionIndex()
+    # Indexing copies the audio and video, keep it off the render path
+    index_threads = []
     
     for section in sections:
-        mode = "intro" if "intro" in yml_file else "content"
+        mode = "intro" if "intro" in os.path.basename(yml_file) else "content"
         
         slide_layout = presentation.slide_layouts[3]
         print(f"{mode.upper()}: {section["title"]}")
@@ -239,27 +264,61 @@ def main(yml_file):
         title_element = slide.shapes.title
         title_element.text = section["title"].strip() 
         
-        print("- Generating bulleted list")
+        match, section_signature = find_reusable_section(section_index, uid, section, mode, reuse, reuse_threshold, os.path.dirname(content_path))
+        if match is not None:
+            print(f"- Reusing outputs of '{match['title']}' ({match['uid']})")
+            bullets = match["bullets"]
+            speaker_transcript = match["transcript"]
+            audio = match["audio_filename"]
+            mp4_filename = match["mp4_filename"]
+        else:
+            print("- Generating bulleted list")
+            bullets = generate_bullets(section["content"])
+        
+            # An avatar job from an interrupted run keeps its transcript, so notes and audio match its video
+            mp4_filename = f"./video/{uid}-video-{sections.index(section)}.mp4"
+            job = journal.find_job(section["content"], mp4_filename)
+            if job is not None and job.get("transcript"):
+                print(f"- Reusing speaker transcript of batch avatar job {job['job_id']}")
+                speaker_transcript = job["transcript"]
+            else:
+                print("- Generating speaker transcript")
+                speaker_transcript = generate_speakertranscript(section["content"], mode)
+            
+            print("- Generating audio")
+            if audio_in_memory:
+                audio_filename = None
+                audio_data = speech.generate_audio(speaker_transcript).audio_data
+                audio = io.BytesIO(audio_data)
+            else:
+                audio_filename = f"./audio/{uid}-audio-{sections.index(section)}.wav"
+                audio_data = None
+                audio = audio_filename
+                speech.generate_audio(speaker_transcript, audio_filename)
+            
+            print("- Generating video")
+            speech.generate_video(speaker_transcript, mp4_filename, source=section["content"])
+            
+            # The index is only used with --reuse ask/auto, so only pay for it then
+            if reuse != "off" and (audio_data is not None if audio_in_memory else os.path.exists(audio_filename)) and os.path.exists(mp4_filename):
+                index_thread = threading.Thread(target=section_index.add, args=(uid, section["title"], mode, section_signature, bullets, speaker_transcript, audio_filename, mp4_filename, audio_data))
+                index_thread.start()
+                index_threads.append(index_thread)
+
         content_placeholder = next(shape for shape in slide.placeholders if shape.name == "Content Placeholder 2")
         text_box = content_placeholder.text_frame
-        bullets = generate_bullets(section["content"])
         for bullet in bullets.split('\n'):
             p = text_box.add_paragraph()
             p.text = bullet.replace("- ", "").strip()
     
-        print("- Generating speaker transcript")
-        speaker_transcript = generate_speakertranscript(section["content"], mode)
         notes_part = slide.notes_slide
         notes_part.notes_text_frame.text = speaker_transcript 
         
-        print("- Generating audio")
-        audio_filename = f"./audio/audio-{sections.index(section)}.wav"
-        generate_audio(speaker_transcript, audio_filename)
-        audio = slide.shapes.add_movie(audio_filename, 0, 0, 1, 1, mime_type="audio/mpeg")
-        
-        print("- Generating video")
-        mp4_filename = f"./video/video-{sections.index(section)}.mp4"
-        generate_video(speaker_transcript, mp4_filename)
+        if isinstance(audio, io.BytesIO):
+            # python-pptx names media from a stream after its MIME type (mediaN.vid),
+            # relate the part under a .wav name first, add_movie then reuses it
+            slide.part.get_or_add_video_media_part(Video.from_blob(audio.getvalue(), "audio/mpeg", f"{uid}-audio-{sections.index(section)}.wav"))
+        slide.shapes.add_movie(audio, 0, 0, 1, 1, mime_type="audio/mpeg")
         
         width = Inches(5.56)
         height = Inches(7.5)
@@ -272,14 +331,25 @@ def main(yml_file):
         slide.shapes._spTree.remove(movie._element)
         slide.shapes._spTree.insert(2, movie._element)
                 
+    for index_thread in index_threads:
+        index_thread.join()
+    
     presentation.save(f"output/{uid}.pptx")
+    return f"output/{uid}.pptx"
     
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="yaml-to-pptx-video", description="Generate powerpoint video from a module YAML file.")
     parser.add_argument("--yml_file", type=str, help="Path to the YAML file.", required=True)
+    parser.add_argument("--reuse", type=str, choices=["off", "ask", "auto"], default="off", help="Reuse outputs of previously rendered near-duplicate sections: never (off), after confirmation (ask) or automatically (auto).")
+    parser.add_argument("--reuse_threshold", type=float, default=0.9, help="Minimum similarity (0-1) for a section to be considered a near-duplicate.")
+    parser.add_argument("--min_tokens", type=int, default=0, help="Merge sections smaller than this many tokens with their neighbour (0 disables merging).")
+    parser.add_argument("--max_tokens", type=int, default=0, help="Split sections larger than this many tokens at paragraph breaks (0 disables splitting).")
+    parser.add_argument("--audio_in_memory", action="store_true", help="Embed the synthesized audio directly instead of writing it to ./audio first.")
     parser.print_help()
     args = parser.parse_args()
+    if args.min_tokens and args.max_tokens and args.min_tokens > args.max_tokens:
+        parser.error("--min_tokens cannot be larger than --max_tokens")
     
     print("")
     
-    main(args.yml_file)
\ No newline at end of file
+    main(args.yml_file, args.reuse, args.reuse_threshold, args.min_tokens, args.max_tokens, args.audio_in_memory)
\ No newline at end of file